@@ -1,94 +1,364 @@
-import json
 import argparse
+import mmap
+import os
+import sqlite3
+import threading
 from pathlib import Path
 
+import msgspec
+import orjson
+
 # Use absolute paths relative to this file's directory to avoid CWD issues
 BASE_DIR = Path(__file__).parent.resolve()
-AUTH_CARDS_FILE = str((BASE_DIR / 'authorized_cards.json').resolve())
-LOG_FILE = str((BASE_DIR / 'access_log.json').resolve())
+# Diretório dos dados; pode ser trocado pela variável RFID_DATA_DIR ou por configure()
+DATA_DIR = Path(os.environ.get('RFID_DATA_DIR', BASE_DIR)).resolve()
+DB_FILE = str(DATA_DIR / 'cards.db')
+# Arquivos JSON antigos, importados para o banco na primeira execução
+AUTH_CARDS_FILE = str(DATA_DIR / 'authorized_cards.json')
+LOG_FILE = str(DATA_DIR / 'access_log.jsonl')
+LEGACY_LOG_FILE = str(DATA_DIR / 'access_log.json')  # Array JSON das versões mais antigas
 
-def load_cards():
+SCHEMA_VERSION = 3
+
+# Cartões criados quando o banco é novo e não há authorized_cards.json para importar
+DEFAULT_CARDS = {
+    "0x1a2b3c4d": {"name": "Cartão de Admin", "authorized": True},
+    "0xabcdef12": {"name": "Cartão de Visitante", "authorized": False},
+}
+
+
+class LogEntry(msgspec.Struct):
+    """Uma tentativa de acesso registrada."""
+    card_id: str
+    timestamp: str
+    authorized: bool = False
+
+
+# Decoder pré-compilado para as linhas do log JSONL antigo
+_LOG_DEC = msgspec.json.Decoder(LogEntry)
+
+# Conexão única compartilhada entre threads (servidor e Streamlit); o lock serializa as transações
+_conn = None
+_db_lock = threading.RLock()
+
+
+def configure(data_dir):
+    """Aponta o módulo para outro diretório de dados (caminhos absolutos, sem mudar o CWD).
+
+    Fecha a conexão atual; a próxima operação abre o banco no novo diretório.
+    """
+    global DATA_DIR, DB_FILE, AUTH_CARDS_FILE, LOG_FILE, LEGACY_LOG_FILE, _conn
+    with _db_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        DATA_DIR = Path(data_dir).resolve()
+        DB_FILE = str(DATA_DIR / 'cards.db')
+        AUTH_CARDS_FILE = str(DATA_DIR / 'authorized_cards.json')
+        LOG_FILE = str(DATA_DIR / 'access_log.jsonl')
+        LEGACY_LOG_FILE = str(DATA_DIR / 'access_log.json')
+
+def _to_map(data):
+    """Converte o formato antigo (lista de cartões) para o formato indexado por ID."""
+    cards = data.get("cards", {})
+    if isinstance(cards, list):
+        data["cards"] = {
+            card.get("id"): {"name": card.get("name"), "authorized": bool(card.get("authorized"))}
+            for card in cards
+            if card.get("id")
+        }
+    elif not isinstance(cards, dict):
+        data["cards"] = {}
+    return data
+
+def _read_json_cards(path):
     try:
-        with open(AUTH_CARDS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"cards": []}
+        with open(path, 'rb') as f:
+            return _to_map(orjson.loads(f.read()))["cards"]
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+def _read_jsonl_logs(path):
+    """Lê um log de acesso em JSONL, ignorando linhas vazias ou corrompidas.
+
+    O arquivo é mapeado em memória (mmap) para evitar copiar o conteúdo inteiro.
+    """
+    logs = []
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return logs
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b''):
+                    if not line.strip():
+                        continue
+                    try:
+                        logs.append(_LOG_DEC.decode(line))
+                    except msgspec.DecodeError:
+                        continue
+    except FileNotFoundError:
+        pass
+    return logs
+
+def _read_logs(path):
+    """Lê um log de acesso no formato antigo (array JSON) ou em JSONL.
+
+    O formato é decidido pelo primeiro byte não branco: '[' indica o array antigo.
+    """
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(64)
+                if not chunk:
+                    return []
+                stripped = chunk.lstrip()
+                if stripped:
+                    first = stripped[:1]
+                    break
+            if first != b'[':
+                return _read_jsonl_logs(path)
+            f.seek(0)
+            data = orjson.loads(f.read())
+    except FileNotFoundError:
+        return []
+    except orjson.JSONDecodeError:
+        return []
+    logs = []
+    for item in data:
+        try:
+            logs.append(msgspec.convert(item, LogEntry))
+        except msgspec.ValidationError:
+            continue
+    return logs
+
+def _read_default_logs():
+    # access_log.json (array antigo) é anterior a access_log.jsonl
+    return _read_logs(LEGACY_LOG_FILE) + _read_logs(LOG_FILE)
+
+def _create_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cards (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            authorized INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS access_log (
+            ts TEXT NOT NULL,
+            card_id TEXT NOT NULL,
+            authorized INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_ts ON access_log(ts DESC)")
+    # Torna a importação idempotente: o mesmo registro importado duas vezes é ignorado
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_log_unique ON access_log(ts, card_id, authorized)")
+    # Contador de versão dos cartões, incrementado por triggers a cada alteração em cards;
+    # permite ao painel invalidar o cache dos cartões sem reagir aos registros de acesso
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('cards_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cards_version_{event.lower()} AFTER {event} ON cards
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'cards_version';
+            END
+        """)
+
+def _write_cards(conn, cards):
+    conn.executemany(
+        "INSERT OR REPLACE INTO cards (id, name, authorized) VALUES (?, ?, ?)",
+        [(card_id, card.get("name"), int(bool(card.get("authorized")))) for card_id, card in cards.items()],
+    )
+
+def _insert_logs(conn, entries):
+    """Insere LogEntry ignorando os já existentes; retorna quantos foram gravados."""
+    cur = conn.executemany(
+        "INSERT OR IGNORE INTO access_log (ts, card_id, authorized) VALUES (?, ?, ?)",
+        [(entry.timestamp, entry.card_id, int(entry.authorized)) for entry in entries],
+    )
+    return max(cur.rowcount, 0)
+
+def import_json(cards_file=None, log_file=None):
+    """Importa cartões (authorized_cards.json) e registros para o banco.
+
+    Sem log_file, importa access_log.json (array antigo) e access_log.jsonl. Cartões com
+    o mesmo ID são sobrescritos; registros já presentes no banco são ignorados.
+    Retorna (cartões, registros novos) importados.
+    """
+    # Abre (e migra, se for um banco novo) antes de ler os arquivos
+    conn = get_connection()
+    cards = _read_json_cards(cards_file or AUTH_CARDS_FILE) or {}
+    logs = _read_logs(log_file) if log_file else _read_default_logs()
+    with _db_lock, conn:
+        _write_cards(conn, cards)
+        n_logs = _insert_logs(conn, logs)
+    return len(cards), n_logs
+
+def _migrate(conn):
+    """Cria/atualiza o esquema e, na primeira vez, importa os arquivos JSON existentes.
+
+    Tudo roda numa única transação BEGIN IMMEDIATE: se servidor, painel e CLI abrirem
+    um banco novo ao mesmo tempo, só o primeiro importa; os demais esperam e retornam.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Relido já com a trava de escrita: outro processo pode ter migrado enquanto esperávamos
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            conn.rollback()
+            return
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 1:
+            # Bancos da versão 1 podem ter registros duplicados por importações repetidas
+            conn.execute("""
+                DELETE FROM access_log WHERE rowid NOT IN (
+                    SELECT MIN(rowid) FROM access_log GROUP BY ts, card_id, authorized
+                )
+            """)
+        _create_schema(conn)
+        if version < 1:
+            cards = _read_json_cards(AUTH_CARDS_FILE)
+            _write_cards(conn, DEFAULT_CARDS if cards is None else cards)
+            _insert_logs(conn, _read_default_logs())
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def get_connection():
+    """Abre (uma única vez) a conexão com o banco em modo WAL."""
+    global _conn
+    with _db_lock:
+        if _conn is None:
+            # timeout generoso: a primeira abertura pode esperar a migração de outro processo
+            conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False)
+            # WAL: o servidor grava registros enquanto o painel lê ao mesmo tempo
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _migrate(conn)
+            _conn = conn
+        return _conn
+
+def load_cards():
+    conn = get_connection()
+    with _db_lock:
+        rows = conn.execute("SELECT id, name, authorized FROM cards ORDER BY rowid").fetchall()
+    return {"cards": {card_id: {"name": name, "authorized": bool(authorized)} for card_id, name, authorized in rows}}
+
+def cards_version():
+    """Número que muda sempre que algum cartão é adicionado, alterado ou excluído."""
+    conn = get_connection()
+    with _db_lock:
+        return conn.execute("SELECT value FROM meta WHERE key = 'cards_version'").fetchone()[0]
 
 def save_cards(data):
-    with open(AUTH_CARDS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-    print(f"Dados do cartão salvos em {AUTH_CARDS_FILE}")
+    """Substitui todos os cartões do banco pelos de data, numa única transação."""
+    conn = get_connection()
+    with _db_lock, conn:
+        conn.execute("DELETE FROM cards")
+        _write_cards(conn, _to_map(data)["cards"])
+    print(f"Dados do cartão salvos em {DB_FILE}")
 
 def list_cards():
     card_data = load_cards()
     print("\n--- Cartões Autorizados ---")
     print(f"{'ID do Cartão':<15} {'Nome':<20} {'Status':<10}")
     print("-" * 45)
-    for card in card_data.get("cards", []):
+    for card_id, card in card_data["cards"].items():
         status = "Autorizado" if card.get("authorized") else "Negado"
-        print(f"{card.get('id'):<15} {card.get('name'):<20} {status:<10}")
+        print(f"{card_id:<15} {card.get('name'):<20} {status:<10}")
 
 def add_card(card_id, name, authorized=True):
-    card_data = load_cards()
-    
-    # Verifica se o cartão já existe
-    for card in card_data.get("cards", []):
-        if card.get("id") == card_id:
-            print(f"Cartão {card_id} já existe!")
-            return
-
-    # Adicionar novo cartão
-    new_card = {
-        "id": card_id,
-        "name": name,
-        "authorized": authorized
-    }
-    card_data["cards"].append(new_card)
-    save_cards(card_data)
+    conn = get_connection()
+    with _db_lock, conn:
+        # INSERT OR IGNORE: a chave primária já detecta cartões repetidos
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO cards (id, name, authorized) VALUES (?, ?, ?)",
+            (card_id, name, int(authorized)),
+        )
+    if cur.rowcount == 0:
+        print(f"Cartão {card_id} já existe!")
+        return
     print(f"Cartão adicionado: {card_id} - {name} ({'Autorizado' if authorized else 'Negado'})")
 
 def delete_card(card_id):
-    card_data = load_cards()
-    initial_count = len(card_data.get("cards", []))
-    
-    card_data["cards"] = [card for card in card_data.get("cards", []) 
-                         if card.get("id") != card_id]
+    conn = get_connection()
+    with _db_lock, conn:
+        cur = conn.execute("DELETE FROM cards WHERE id = ?", (card_id,))
     
-    if len(card_data.get("cards", [])) < initial_count:
-        save_cards(card_data)
+    if cur.rowcount:
         print(f"Cartão excluído: {card_id}")
     else:
         print(f"Cartão {card_id} não encontrado!")
 
 def update_card(card_id, authorized):
-    card_data = load_cards()
-    found = False
+    conn = get_connection()
+    with _db_lock, conn:
+        cur = conn.execute("UPDATE cards SET authorized = ? WHERE id = ?", (int(authorized), card_id))
     
-    for card in card_data.get("cards", []):
-        if card.get("id") == card_id:
-            card["authorized"] = authorized
-            found = True
-            break
-    
-    if found:
-        save_cards(card_data)
+    if cur.rowcount:
         print(f"Cartão atualizado {card_id}: {'Autorizado' if authorized else 'Negado'}")
     else:
         print(f"Cartão {card_id} não encontrado!")
 
+def is_card_authorized(card_id):
+    conn = get_connection()
+    with _db_lock:
+        row = conn.execute("SELECT authorized FROM cards WHERE id = ?", (card_id,)).fetchone()
+    return bool(row and row[0])
+
+def append_logs(entries):
+    """Grava vários LogEntry numa única transação."""
+    conn = get_connection()
+    with _db_lock, conn:
+        _insert_logs(conn, entries)
+
+def clear_logs():
+    conn = get_connection()
+    with _db_lock, conn:
+        conn.execute("DELETE FROM access_log")
+
+def load_logs():
+    """Todos os registros de acesso, do mais antigo ao mais recente."""
+    conn = get_connection()
+    with _db_lock:
+        rows = conn.execute("SELECT card_id, ts, authorized FROM access_log ORDER BY ts").fetchall()
+    return [LogEntry(card_id, ts, bool(authorized)) for card_id, ts, authorized in rows]
+
+def tail_logs(n, authorized=None):
+    """Últimos n registros de acesso (mais recentes primeiro), opcionalmente filtrados por status."""
+    query = "SELECT card_id, ts, authorized FROM access_log"
+    params = []
+    if authorized is not None:
+        query += " WHERE authorized = ?"
+        params.append(int(authorized))
+    query += " ORDER BY ts DESC LIMIT ?"
+    params.append(n)
+    conn = get_connection()
+    with _db_lock:
+        rows = conn.execute(query, params).fetchall()
+    return [LogEntry(card_id, ts, bool(auth)) for card_id, ts, auth in rows]
+
 def show_logs():
-    try:
-        with open(LOG_FILE, 'r') as f:
-            logs = json.load(f)
-        
-        print("\n--- Registros de Acesso ---")
-        print(f"{'Data/Hora':<25} {'ID do Cartão':<15} {'Status':<10}")
-        print("-" * 50)
-        for entry in logs:
-            status = "Autorizado" if entry.get("authorized") else "Negado"
-            print(f"{entry.get('timestamp'):<25} {entry.get('card_id'):<15} {status:<10}")
-    except (FileNotFoundError, json.JSONDecodeError):
+    logs = load_logs()
+    if not logs:
         print("Nenhum registro de acesso disponível.")
+        return
+
+    print("\n--- Registros de Acesso ---")
+    print(f"{'Data/Hora':<25} {'ID do Cartão':<15} {'Status':<10}")
+    print("-" * 50)
+    for entry in logs:
+        status = "Autorizado" if entry.authorized else "Negado"
+        print(f"{entry.timestamp:<25} {entry.card_id:<15} {status:<10}")
 
 def main():
     parser = argparse.ArgumentParser(description='Ferramenta de Gerenciamento de Cartões RFID')
@@ -116,6 +386,11 @@ def main():
     # Comando para mostrar registros
     subparsers.add_parser('logs', help='Mostrar registros de acesso')
     
+    # Comando para importar os arquivos JSON antigos para o banco
+    import_parser = subparsers.add_parser('import', help='Importar cartões e registros de arquivos JSON')
+    import_parser.add_argument('--cards', default=AUTH_CARDS_FILE, help='Arquivo JSON de cartões')
+    import_parser.add_argument('--logs', help='Arquivo de registros (array JSON ou JSONL); padrão: access_log.json e access_log.jsonl')
+    
     args = parser.parse_args()
     
     if args.command == 'list':
@@ -135,6 +410,9 @@ def main():
             print("Erro: Deve especificar --authorize ou --deny")
     elif args.command == 'logs':
         show_logs()
+    elif args.command == 'import':
+        n_cards, n_logs = import_json(args.cards, args.logs)
+        print(f"Importados {n_cards} cartões e {n_logs} registros para {DB_FILE}")
     else:
         parser.print_help()
 
@@ -1,9 +1,12 @@
-import json
+import queue
+import selectors
 import socket
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pathlib import Path
-from time import sleep
+from time import monotonic
+
+import card_manager as cm
 
 # Tenta importar RPi.GPIO; se não estiver disponível (ex: desenvolvimento no Windows), usa mock
 try:
@@ -15,18 +18,35 @@ except ImportError:
 
 HOST = '0.0.0.0'  # Escutar em todas as interfaces de rede
 PORT = 5000       # Porta para escutar
-BASE_DIR = Path(__file__).parent.resolve()
-LOG_FILE = str((BASE_DIR / 'access_log.json').resolve())
-AUTH_CARDS_FILE = str((BASE_DIR / 'authorized_cards.json').resolve())
 
 # Configuração do pino GPIO para o solenóide/relé
 SOLENOID_PIN = 18          # Pino BCM conectado ao relé do solenóide
 DOOR_OPEN_SECONDS = 3      # Tempo que a porta fica destrancada (segundos)
 
+# Limites de concorrência das conexões dos clientes
+MAX_WORKERS = 8            # Máximo de conexões atendidas simultaneamente
+CLIENT_TIMEOUT = 5.0       # Tempo máximo (segundos) de espera por um cliente lento
+MAX_FRAME_BYTES = 128      # Tamanho máximo aceito para a mensagem com o ID do cartão
+
+# Gravação do log em lotes por uma thread dedicada
+LOG_FLUSH_INTERVAL = 0.1   # Tempo máximo (segundos) que um registro espera para ser gravado
+LOG_BATCH_MAX = 512        # Máximo de registros gravados numa mesma transação
+
+# Respostas já codificadas; o ESP32 compara o texto exato, sem quebra de linha
+_RESP = {True: b"AUTHORIZED", False: b"DENIED"}
+
 class RFIDServer:
     def __init__(self):
         self.server_socket = None
-        self.authorized_cards = self.load_authorized_cards()
+        self._pool = None
+        # Estado da porta: o timer ativo religa a trava; novos toques o substituem
+        self._door_lock = threading.Lock()
+        self._door_timer = None
+        # Abre o banco (cards.db) já na inicialização, importando os JSON antigos se preciso
+        cm.get_connection()
+        # Fila de registros de acesso, esvaziada em lotes por _log_writer
+        self._log_q = queue.Queue()
+        self._log_thread = None
         self._setup_gpio()
 
     def _setup_gpio(self):
@@ -40,66 +60,103 @@ class RFIDServer:
             print(f"GPIO {SOLENOID_PIN} configurado para controle do solenóide.")
 
     def _unlock_door(self):
-        """Destrava a porta por DOOR_OPEN_SECONDS segundos."""
+        """Destrava a porta por DOOR_OPEN_SECONDS segundos sem bloquear a thread chamadora.
+
+        Toques autorizados com a porta já aberta apenas prolongam o tempo aberta.
+        """
         if not GPIO_AVAILABLE:
             print(f"[SIMULAÇÃO] Porta destrancada por {DOOR_OPEN_SECONDS}s")
             return
-        print("Destrancando porta...")
-        GPIO.output(SOLENOID_PIN, GPIO.LOW)   # Ativa o relé (solenóide ligado)
-        sleep(DOOR_OPEN_SECONDS)
-        GPIO.output(SOLENOID_PIN, GPIO.HIGH)  # Desativa o relé (solenóide desligado)
-        print("Porta trancada novamente.")
+        with self._door_lock:
+            if self._door_timer is not None:
+                self._door_timer.cancel()
+            else:
+                print("Destrancando porta...")
+                GPIO.output(SOLENOID_PIN, GPIO.LOW)   # Ativa o relé (solenóide ligado)
+            self._door_timer = threading.Timer(DOOR_OPEN_SECONDS, self._relock_door)
+            self._door_timer.daemon = True
+            self._door_timer.start()
 
-    def load_authorized_cards(self):
-        try:
-            with open(AUTH_CARDS_FILE, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # Criar um arquivo padrão se não existir ou for inválido
-            default_cards = {
-                "cards": [
-                    {"id": "0x1a2b3c4d", "name": "Cartão de Admin", "authorized": True},
-                    {"id": "0xabcdef12", "name": "Cartão de Visitante", "authorized": False}
-                ]
-            }
-            with open(AUTH_CARDS_FILE, 'w') as f:
-                json.dump(default_cards, f, indent=4)
-            return default_cards
+    def _relock_door(self):
+        """Chamado pelo timer ao fim do tempo de abertura."""
+        with self._door_lock:
+            # Um toque mais recente substituiu este timer; ele cuidará de trancar
+            if self._door_timer is not threading.current_thread():
+                return
+            self._door_timer = None
+            GPIO.output(SOLENOID_PIN, GPIO.HIGH)  # Desativa o relé (solenóide desligado)
+            print("Porta trancada novamente.")
 
     def save_access_log(self, card_id, authorized):
-        try:
-            log_data = []
+        # Só enfileira; a gravação no banco acontece em lote na thread _log_writer
+        self._log_q.put(cm.LogEntry(card_id, datetime.now().isoformat(), authorized))
+
+    def _log_writer(self):
+        """Grava os registros enfileirados, juntando em uma transação os que chegam em LOG_FLUSH_INTERVAL."""
+        while True:
+            entry = self._log_q.get()
+            if entry is None:
+                return
+            batch = [entry]
+            stop = False
+            deadline = monotonic() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_MAX:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._log_q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
             try:
-                with open(LOG_FILE, 'r') as f:
-                    log_data = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                log_data = []
-            
-            log_entry = {
-                "card_id": card_id,
-                "timestamp": datetime.now().isoformat(),
-                "authorized": authorized
-            }
-            log_data.append(log_entry)
-            
-            with open(LOG_FILE, 'w') as f:
-                json.dump(log_data, f, indent=4)
-        except Exception as e:
-            print(f"Erro ao registrar acesso: {e}")
+                cm.append_logs(batch)
+            except Exception as e:
+                print(f"Erro ao registrar acesso: {e}")
+            if stop:
+                return
+
+    def _start_log_writer(self):
+        self._log_thread = threading.Thread(target=self._log_writer, name='rfid-log', daemon=True)
+        self._log_thread.start()
+
+    def _stop_log_writer(self):
+        """Sinaliza o fim e espera a fila ser gravada (registros anteriores ao sinal)."""
+        if self._log_thread is None:
+            return
+        self._log_q.put(None)
+        self._log_thread.join()
+        self._log_thread = None
 
     def is_card_authorized(self, card_id):
-        # Reload authorized cards on each check so dashboard updates apply immediately
-        self.authorized_cards = self.load_authorized_cards()
-        for card in self.authorized_cards.get("cards", []):
-            if card.get("id") == card_id:
-                return card.get("authorized", False)
-        return False
+        # Consulta o banco a cada toque para que alterações do painel valham imediatamente
+        return cm.is_card_authorized(card_id)
+
+    def _read_frame(self, client_socket):
+        """Lê do cliente até a quebra de linha (client.println no ESP32), EOF ou MAX_FRAME_BYTES."""
+        buf = b''
+        while b'\n' not in buf and len(buf) < MAX_FRAME_BYTES:
+            try:
+                chunk = client_socket.recv(MAX_FRAME_BYTES - len(buf))
+            except socket.timeout:
+                # Cliente sem quebra de linha: usa o que já chegou, se houver
+                if buf:
+                    break
+                raise
+            if not chunk:
+                break
+            buf += chunk
+        return buf.split(b'\n', 1)[0]
 
     def handle_client(self, client_socket, address):
         print(f"Conexão de {address}")
         try:
             # Receber dados do cliente (ESP32)
-            data = client_socket.recv(1024).decode('utf-8').strip()
+            # IDs de cartão são hexadecimais (ASCII); decodifica uma única vez
+            data = self._read_frame(client_socket).strip().decode('ascii', 'replace')
             print(f"Recebido: {data}")
             
             # Verificar se o cartão está autorizado
@@ -110,35 +167,61 @@ class RFIDServer:
 
             # Se autorizado, destrancar a porta
             if authorized:
-                # Executa em thread separada para não bloquear outras conexões
-                unlock_thread = threading.Thread(target=self._unlock_door, daemon=True)
-                unlock_thread.start()
+                # Retorna imediatamente; um timer tranca a porta depois
+                self._unlock_door()
 
             # Enviar resposta de volta ao ESP32
-            response = "AUTHORIZED" if authorized else "DENIED"
-            client_socket.sendall(response.encode('utf-8'))
-            print(f"Resposta enviada: {response}")
+            response = _RESP[authorized]
+            client_socket.sendall(response)
+            print(f"Resposta enviada: {response.decode('ascii')}")
         except Exception as e:
             print(f"Erro ao processar cliente: {e}")
         finally:
             client_socket.close()
 
+    def _accept_clients(self):
+        """Aceita todas as conexões pendentes de uma vez e as envia ao pool."""
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except BlockingIOError:
+                return
+            # Evita que um ESP32 travado ocupe um worker indefinidamente
+            client_socket.settimeout(CLIENT_TIMEOUT)
+            # Mensagens pequenas: desativa o algoritmo de Nagle para responder sem atraso
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pool.submit(self.handle_client, client_socket, address)
+
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.server_socket.bind((HOST, PORT))
         self.server_socket.listen(5)
+        self.server_socket.setblocking(False)
         print(f"Servidor escutando em {HOST}:{PORT}")
         
+        # Thread única que grava o log de acesso em lotes
+        self._start_log_writer()
+        # Pool limitado de workers em vez de uma thread nova por conexão
+        self._pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='rfid')
+        # Seletor (epoll no Linux): um único wait drena várias conexões prontas
+        selector = selectors.DefaultSelector()
+        selector.register(self.server_socket, selectors.EVENT_READ, self._accept_clients)
         try:
             while True:
-                client_socket, address = self.server_socket.accept()
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address))
-                client_thread.daemon = True
-                client_thread.start()
+                for key, _ in selector.select(timeout=1.0):
+                    key.data()
         except KeyboardInterrupt:
             print("Servidor desligando")
         finally:
+            selector.close()
+            # Espera os clientes em andamento (limitado por CLIENT_TIMEOUT) antes de encerrar o log,
+            # para que nenhum registro seja enfileirado depois do sinal de fim
+            self._pool.shutdown(wait=True)
+            self._stop_log_writer()
             self._cleanup_gpio()
             if self.server_socket:
                 self.server_socket.close()
@@ -146,6 +229,10 @@ class RFIDServer:
     def _cleanup_gpio(self):
         """Libera os recursos do GPIO ao encerrar."""
         if GPIO_AVAILABLE:
+            with self._door_lock:
+                if self._door_timer is not None:
+                    self._door_timer.cancel()
+                    self._door_timer = None
             GPIO.output(SOLENOID_PIN, GPIO.HIGH)  # Garante porta trancada
             GPIO.cleanup()
             print("GPIO liberado.")
@@ -1,9 +1,9 @@
 from pathlib import Path
 import os
-import json
-from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 import streamlit as st
 try:
     # Optional auto-refresh helper
@@ -11,39 +11,73 @@ try:
 except Exception:  # pragma: no cover
     st_autorefresh = None
 
-# Base path of the server directory (use absolute paths; do not change CWD to avoid Streamlit reload issues)
-BASE_DIR = Path(__file__).parent.resolve()
-
+# Data paths are absolute and owned by card_manager (cm.DB_FILE); do not change CWD
 import card_manager as cm  # noqa: E402
 
-ACCESS_LOG = BASE_DIR / 'access_log.json'
-CARDS_FILE = BASE_DIR / 'authorized_cards.json'
-
 
-def _load_logs() -> List[Dict]:
+def _mtime_ns(path: Path) -> int:
     try:
-        with open(ACCESS_LOG, 'r', encoding='utf-8') as f:
-            logs = json.load(f)
-            # Normalize and sort by timestamp desc
-            for row in logs:
-                # Ensure iso timestamp string
-                if isinstance(row.get('timestamp'), str):
-                    try:
-                        row['_ts'] = datetime.fromisoformat(row['timestamp'])
-                    except Exception:
-                        row['_ts'] = None
-                else:
-                    row['_ts'] = None
-            logs.sort(key=lambda r: r.get('_ts') or datetime.min, reverse=True)
-            return logs
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
 
 
-def _load_cards() -> Dict:
+def _db_version() -> Tuple[int, int]:
+    # Cache key for the access log. In WAL mode writes land in the -wal file first,
+    # so both mtimes make up the key
+    db_file = Path(cm.DB_FILE)
+    return _mtime_ns(db_file), _mtime_ns(db_file.with_name(db_file.name + '-wal'))
+
+
+# Small max_entries: every swipe creates a new key, so stale versions must be evicted
+@st.cache_data(show_spinner=False, max_entries=4)
+def _recent_logs_cached(version: Tuple[int, int], limit: int, authorized: Optional[bool]) -> List[cm.LogEntry]:
+    # version is only the cache key: a new write to the database invalidates the entry.
+    # Ordering and LIMIT are done by SQLite on the timestamp index.
+    return cm.tail_logs(limit, authorized)
+
+
+def _recent_logs(limit: int, authorized: Optional[bool] = None) -> List[cm.LogEntry]:
+    return _recent_logs_cached(_db_version(), limit, authorized)
+
+
+def _logs_frame(logs: List[cm.LogEntry]) -> pd.DataFrame:
+    # Build the table column by column instead of one dict per row
+    return pd.DataFrame({
+        "Data/Hora": [r.timestamp for r in logs],
+        "ID do Cartão": [r.card_id for r in logs],
+        "Status": np.where([r.authorized for r in logs], "AUTORIZADO", "NEGADO"),
+    })
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _load_cards_cached(version: int) -> Dict:
+    # version is cm.cards_version(), bumped only when cards change (not on log writes)
     return cm.load_cards()
 
 
+def _load_cards() -> Dict:
+    return _load_cards_cached(cm.cards_version())
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _card_search_index_cached(version: int) -> Tuple[List[str], List[str], List[str]]:
+    # Parallel arrays (ids, lowercased ids, lowercased names), built once per cards version
+    cards = _load_cards_cached(version).get('cards', {})
+    ids = list(cards)
+    ids_lc = [cid.lower() for cid in ids]
+    names_lc = [(cards[cid].get('name') or '').lower() for cid in ids]
+    return ids, ids_lc, names_lc
+
+
+def _search_cards(q: str) -> List[str]:
+    ids, ids_lc, names_lc = _card_search_index_cached(cm.cards_version())
+    if not q:
+        return ids
+    ql = q.lower()
+    return [ids[i] for i, (a, b) in enumerate(zip(ids_lc, names_lc)) if ql in a or ql in b]
+
+
 def _save_cards(data: Dict) -> None:
     cm.save_cards(data)
 
@@ -68,11 +102,13 @@ with st.sidebar:
 
 tab_dashboard, tab_cards, tab_logs = st.tabs(["📊 Painel", "💳 Cartões", "🧾 Registros"]) 
 
+# Load once per render and share between tabs
+cards_data = _load_cards()
+
 with tab_dashboard:
-    cards_data = _load_cards()
-    cards = cards_data.get('cards', [])
+    cards = cards_data.get('cards', {})
     total = len(cards)
-    authorized = sum(1 for c in cards if c.get('authorized'))
+    authorized = sum(1 for c in cards.values() if c.get('authorized'))
     denied = total - authorized
 
     c1, c2, c3 = st.columns(3)
@@ -81,30 +117,25 @@ with tab_dashboard:
     c3.metric("Negados", denied)
 
     st.subheader("Tentativas Recentes de Acesso")
-    logs = _load_logs()
-    if logs:
-        # Prepare display-friendly rows
-        rows = []
-        for r in logs[:100]:
-            rows.append({
-                "Data/Hora": r.get('timestamp'),
-                "ID do Cartão": r.get('card_id'),
-                "Status": "AUTORIZADO" if r.get('authorized') else "NEGADO",
-            })
-        st.dataframe(rows, use_container_width=True, height=400)
+    recent = _recent_logs(100)
+    if recent:
+        st.dataframe(_logs_frame(recent), use_container_width=True, height=400)
     else:
         st.info("Ainda não há registros de acesso.")
 
 with tab_cards:
     st.subheader("Cartões Autorizados")
-    cards_data = _load_cards()
-    current_cards = cards_data.get('cards', [])
+    current_cards = cards_data.get('cards', {})
 
     # Filter/Search
     q = st.text_input("Pesquisar por ID ou Nome", "")
-    filtered = [c for c in current_cards if q.lower() in c.get('id', '').lower() or q.lower() in c.get('name', '').lower()]
-    table_rows = [{"ID": c.get('id'), "Nome": c.get('name'), "Autorizado": c.get('authorized')} for c in filtered]
-    st.dataframe(table_rows, use_container_width=True, height=300)
+    filtered = [(cid, current_cards[cid]) for cid in _search_cards(q) if cid in current_cards]
+    cards_df = pd.DataFrame({
+        "ID": [cid for cid, _ in filtered],
+        "Nome": [c.get('name') for _, c in filtered],
+        "Autorizado": [bool(c.get('authorized')) for _, c in filtered],
+    })
+    st.dataframe(cards_df, use_container_width=True, height=300)
 
     st.divider()
     col_add, col_update = st.columns(2)
@@ -121,7 +152,7 @@ with tab_cards:
                 st.error("Por favor, informe o ID do Cartão e o Nome.")
             else:
                 # Prevent duplicate add in UI (card_manager also checks)
-                if any(c.get('id') == new_id for c in current_cards):
+                if new_id in current_cards:
                     st.warning(f"O cartão {new_id} já existe.")
                 else:
                     cm.add_card(new_id, new_name, new_auth)
@@ -130,12 +161,12 @@ with tab_cards:
 
     with col_update:
         st.markdown("### Atualizar/Excluir Cartão")
-        card_ids = [c.get('id') for c in current_cards]
+        card_ids = list(current_cards)
         if not card_ids:
             st.info("Sem cartões para atualizar.")
         else:
             selected_id = st.selectbox("Selecione o ID do Cartão", options=card_ids)
-            selected = next((c for c in current_cards if c.get('id') == selected_id), None)
+            selected = current_cards.get(selected_id)
             if selected:
                 st.write(f"Nome: {selected.get('name')}")
                 new_status = st.radio("Autorização", options=["Autorizado", "Negado"], index=0 if selected.get('authorized') else 1, horizontal=True)
@@ -153,7 +184,6 @@ with tab_cards:
 
 with tab_logs:
     st.subheader("Registros de Acesso")
-    logs = _load_logs()
 
     colf1, colf2 = st.columns(2)
     with colf1:
@@ -161,24 +191,13 @@ with tab_logs:
     with colf2:
         limit = st.selectbox("Mostrar os últimos N", options=[50, 100, 200, 500, 1000], index=1)
 
-    if status_filter != "Todos":
-        want = (status_filter == "Autorizado")
-        logs = [r for r in logs if bool(r.get('authorized')) == want]
-
-    rows = []
-    for r in logs[:limit]:
-        rows.append({
-            "Data/Hora": r.get('timestamp'),
-            "ID do Cartão": r.get('card_id'),
-            "Status": "AUTORIZADO" if r.get('authorized') else "NEGADO",
-        })
+    want = None if status_filter == "Todos" else (status_filter == "Autorizado")
+    logs_df = _logs_frame(_recent_logs(limit, want))
 
-    if rows:
-        st.dataframe(rows, use_container_width=True, height=500)
+    if not logs_df.empty:
+        st.dataframe(logs_df, use_container_width=True, height=500)
         if st.button("Limpar Registros"):
-            # Simple clear: overwrite with empty list
-            with open(ACCESS_LOG, 'w', encoding='utf-8') as f:
-                json.dump([], f, indent=4)
+            cm.clear_logs()
             st.warning("Registros limpos.")
             st.rerun()
     else: